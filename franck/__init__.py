@@ -6,7 +6,7 @@ from .misskey_crawler import MisskeyTopUserCrawler
 from .peertube_crawler import PeertubeCrawler
 from .pleroma_crawler import PleromaActiveUserCrawler, PleromaFederationCrawler
 
-from pkg_resources import get_distribution
+from importlib.metadata import version
 
-__version__ = get_distribution("franck").version
+__version__ = version("franck")
 __license__ = "GPLv3"
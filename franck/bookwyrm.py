@@ -3,11 +3,10 @@
 from .common import (
     CrawlerException,
     FederationCrawler,
+    crawl_session,
     fetch_fediverse_instance_list,
 )
 
-DELAY_BETWEEN_CONSECUTIVE_REQUESTS = 0.2
-
 
 class BookwyrmFederationCrawler(FederationCrawler):
     SOFTWARE = "bookwyrm"
@@ -25,12 +24,14 @@ class BookwyrmFederationCrawler(FederationCrawler):
         instance_dict = {"host": host}
         connected_instances = []
         try:
-            info_dict = await self._fetch_json("http://" + host + "/api/v1/instance")
+            info_dict = await self._fetch_json(
+                "https://" + host + "/api/v1/instance", ttl=self.METADATA_CACHE_TTL
+            )
             instance_dict["version"] = info_dict["version"]
             instance_dict["registration_enabled"] = info_dict["registrations"]
 
             connected_instances = list(
-                await self._fetch_json("http://" + host + "/api/v1/instance/peers")
+                await self._fetch_json("https://" + host + "/api/v1/instance/peers")
             )
 
         except CrawlerException as err:
@@ -40,8 +41,9 @@ class BookwyrmFederationCrawler(FederationCrawler):
         await self._write_connected_instance(host, connected_instances)
 
 
-async def launch_bookwyrm_crawl():
-    start_urls = await fetch_fediverse_instance_list("bookwyrm")
+async def launch_bookwyrm_crawl(session=None):
+    async with crawl_session(session) as session:
+        start_urls = await fetch_fediverse_instance_list("bookwyrm", session)
 
-    async with BookwyrmFederationCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with BookwyrmFederationCrawler(start_urls, session) as crawler:
+            await crawler.launch()
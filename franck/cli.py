@@ -2,7 +2,13 @@ import asyncio
 
 from argparse import ArgumentParser
 
+try:
+    import uvloop
+except ImportError:  # Optional dependency (not available on Windows)
+    uvloop = None
+
 from .bookwyrm import launch_bookwyrm_crawl
+from .common import Crawler, crawl_session
 from .friendica import launch_friendica_crawl
 from .lemmy_crawler import launch_lemmy_crawl
 from .mastodon_crawler import launch_mastodon_crawl
@@ -21,6 +27,33 @@ SOFTWARE_LAUNCH = {
 }
 
 
+def run(coroutine):
+    """Runs a coroutine on the uvloop event loop if available."""
+    if uvloop is not None:
+        if hasattr(uvloop, "run"):
+            return uvloop.run(coroutine)
+        # NB: uvloop.run only exists since uvloop 0.18
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coroutine)
+
+
+async def crawl_all_software():
+    """Crawls all the software one after the other with a single HTTP session.
+
+    Returns:
+        List[str]: software whose crawl failed.
+    """
+    errors = []
+    async with crawl_session() as session:
+        for software, launch_function in SOFTWARE_LAUNCH.items():
+            print("Start " + software)
+            try:
+                await launch_function(session)
+            except Exception:
+                errors.append(software)
+    return errors
+
+
 def main():
     parser = ArgumentParser(
         description="Franck crawls the Fediverse to provide various graphs useful for researchers."
@@ -33,21 +66,21 @@ def main():
         help="Fediverse software subject of the crawl",
         choices=list(SOFTWARE_LAUNCH.keys()) + ["all"],
     )
+    crawl_parser.add_argument(
+        "--cache-dir",
+        help="Folder caching the instance metadata between crawls (disabled by default)",
+        default=None,
+    )
     args = parser.parse_args()
 
     if args.subcommand == "crawl":
+        Crawler.RESPONSE_CACHE_DIR = args.cache_dir
         if args.software == "all":
-            errors = []
-            for software, launch_function in SOFTWARE_LAUNCH.items():
-                print("Start " + software)
-                try:
-                    asyncio.run(launch_function())
-                except Exception:
-                    errors.append(software)
-
-            if errors:
+            errors = run(crawl_all_software())
+
+            if not errors:
                 print("All crawl operations finished successfully")
             else:
                 print("Some crawls failed:" + str(errors))
         else:
-            asyncio.run(SOFTWARE_LAUNCH[args.software]())
+            run(SOFTWARE_LAUNCH[args.software]())
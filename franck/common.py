@@ -2,59 +2,204 @@
 
 import asyncio
 import glob
+import gzip
+import hashlib
 from io import TextIOWrapper
-import json
 import logging
 import os
+import socket
+import time
 from abc import abstractmethod
-from csv import DictReader, DictWriter
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from csv import reader as csv_reader, writer as csv_writer
 from datetime import datetime
-from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlsplit
 
 import aiohttp
 import colorlog
+import orjson
 import pandas as pd
-import requests
 
 from aiohttp_retry import RetryClient, ExponentialRetry
 from tqdm.asyncio import tqdm
 
 import franck
 
+USER_AGENT = "Fediverse Graph Crawler (Academic Research)"
+
 
 class CrawlerException(Exception):
-    """Base exception class for the crawlers"""
+    """Base exception class for the crawlers
 
-    def __init__(self, err):
-        self.msg = err
+    NB: the message parts are only joined when the exception is printed,
+    most errors are stored or discarded without being formatted.
+    """
 
     def __str__(self):
-        return self.msg
+        return " ".join(map(str, self.args))
+
+
+async def fetch_fediverse_instance_list(
+    software: str, session: Optional[Union[aiohttp.ClientSession, RetryClient]] = None
+) -> List[str]:
+    """Fetches the list of the instances of a software from fediverse.observer.
 
+    Args:
+        software (str): name of the Fediverse software
+        session (Optional[Union[aiohttp.ClientSession, RetryClient]]): session to reuse.
+            Defaults to None (a temporary session is created).
+
+    Returns:
+        List[str]: hosts of the instances.
+    """
+    if session is None:
+        async with aiohttp.ClientSession() as temp_session:
+            return await fetch_fediverse_instance_list(software, temp_session)
 
-async def fetch_fediverse_instance_list(software):
     # GraphQL query
     body = '''{nodes(softwarename:"''' + software + """" status: "UP"){domain}}"""
 
     try:
-        async with aiohttp.ClientSession() as session:
-            resp = await session.post(
-                "https://api.fediverse.observer", json={"query": body}, timeout=300
-            )
-            data = await resp.read()
-            data = json.loads(data)
-    except json.decoder.JSONDecodeError:  # Sometimes, Cloudflare blocks aiohttp
-        resp = requests.post(
-            "https://api.fediverse.observer", json={"query": body}, timeout=300
+        data = await _post_observer_query(session, body)
+    except orjson.JSONDecodeError:  # Sometimes, Cloudflare blocks aiohttp
+        # NB: the challenge page is mostly triggered by the default aiohttp headers
+        data = await _post_observer_query(
+            session,
+            body,
+            headers={"User-Agent": USER_AGENT, "Accept": "application/json"},
+            skip_auto_headers=["Accept-Encoding"],
         )
-        data = resp.json()
     return [instance["domain"] for instance in data["data"]["nodes"]]
 
 
+async def _post_observer_query(
+    session: Union[aiohttp.ClientSession, RetryClient], body: str, **kwargs
+):
+    async with session.post(
+        "https://api.fediverse.observer", json={"query": body}, timeout=300, **kwargs
+    ) as resp:
+        data = await resp.read()
+    return orjson.loads(data)
+
+
+def url_netloc(url: str) -> str:
+    """Extracts the network location (host and port) of an absolute URL.
+
+    NB: a plain split is much cheaper than urlsplit on well-formed URLs,
+    the other URLs are still handled by urlsplit.
+
+    Args:
+        url (str): absolute URL (e.g., "https://lemmy.ml/u/someone")
+
+    Returns:
+        str: network location of the URL
+    """
+    parts = url.split("/", 3)
+    if len(parts) > 2 and parts[0].endswith(":") and parts[1] == "":
+        return parts[2]
+    return urlsplit(url).netloc
+
+
+def https_unavailable(err: Optional[BaseException]) -> bool:
+    """Checks whether a connection error suggests that a host does not serve HTTPS.
+
+    DNS failures (the host is unreachable whatever the scheme) and SSL errors
+    (e.g., an invalid certificate) never justify a fallback to plain HTTP.
+
+    Args:
+        err (Optional[BaseException]): error raised by the HTTPS query
+
+    Returns:
+        bool: True if the query can be retried over plain HTTP.
+    """
+    if not isinstance(err, aiohttp.ClientConnectorError) or isinstance(
+        err, aiohttp.ClientSSLError
+    ):
+        return False
+    # NB: ClientConnectorDNSError only exists since aiohttp 3.10
+    dns_error = getattr(aiohttp, "ClientConnectorDNSError", None)
+    if dns_error is not None and isinstance(err, dns_error):
+        return False
+    return not isinstance(err.os_error, socket.gaierror)
+
+
+async def gather_or_raise(*aws: Awaitable[Any]) -> List[Any]:
+    """Runs awaitables concurrently and returns their results.
+
+    Contrary to asyncio.gather, all the awaitables are completed before the
+    first exception is raised, so no query keeps running in the background.
+
+    Raises:
+        Exception: the first exception raised by one of the awaitables.
+
+    Returns:
+        List: results of the awaitables (in the same order).
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+class ResponseCache:
+    """On-disk cache of the API responses, shared by consecutive crawls.
+
+    NB: each response is stored in a gzipped JSON file named after the hash of its
+    query. The modification time of the file gives the age of the response.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: bytes) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest() + ".json.gz")
+
+    def get(self, key: bytes, ttl: float) -> Optional[Any]:
+        """Returns the cached response of a query, or None if it is missing or expired."""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                return None
+            with gzip.open(path, "rb") as cache_file:
+                return orjson.loads(cache_file.read())
+        except (OSError, EOFError, orjson.JSONDecodeError):  # Missing or corrupted
+            return None
+
+    def put(self, key: bytes, data: Any):
+        """Stores the response of a query."""
+        path = self._path(key)
+        # NB: the file is renamed once complete so that an interrupted crawl
+        #   cannot leave a truncated response behind.
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wb") as cache_file:
+            cache_file.write(orjson.dumps(data))
+        os.replace(tmp_path, path)
+
+
 class Crawler:
     SOFTWARE: Optional[str] = None
     CRAWL_SUBJECT: Optional[str] = None
-    NB_SEMAPHORE: int = 100
+    NB_SEMAPHORE: int = 100  # Maximum number of concurrent queries
+    NB_HOST_SEMAPHORE: int = 2  # Maximum number of concurrent queries per instance
+    NB_QUERY_ATTEMPTS: int = 3  # Maximum attempts of a throttled or truncated query
+    NB_INSPECTION_WORKERS: int = 100  # Maximum number of instances inspected at once
 
     INTERACTIONS_CSVS = ["interactions.csv"]
     # NB: some crawlers can produce multiple graphs
@@ -71,9 +216,21 @@ class Crawler:
 
     TEMP_FILES = []
 
+    CSV_BUFFER_SIZE = 1 << 16
+    CSV_QUEUE_SIZE = 1024  # Maximum number of pending row batches per file
+
+    # NB: the cache is disabled by default, a crawl should reflect the current state
+    RESPONSE_CACHE_DIR: Optional[str] = None
+    METADATA_CACHE_TTL = 6 * 3600  # Validity (in seconds) of cached instance metadata
+
+    MIN_DELAY_PER_HOST = 0.2  # Minimum delay (in seconds) between two queries
+    THROTTLING_STATUSES = frozenset({429, 503})
+    MAX_HOST_BACKOFF = 60.0  # Maximum delay (in seconds) before querying an instance
+
     def __init__(
         self,
         urls: List[str],
+        session: Optional[RetryClient] = None,
     ):
         assert self.INTERACTIONS_CSV_FIELDS == [
             "Source",
@@ -87,47 +244,70 @@ class Crawler:
             "Label",
         ]:
             assert field in self.INSTANCES_CSV_FIELDS
+        # NB: a set makes the field filtering of the API responses cheaper
+        self.instances_csv_field_set = frozenset(self.INSTANCES_CSV_FIELDS)
 
         assert self.SOFTWARE is not None
         assert self.CRAWL_SUBJECT is not None
 
+        self.crawl_name = self.SOFTWARE + "_" + self.CRAWL_SUBJECT
+
         # Create the result folder
         self.result_dir = (
-            self.SOFTWARE
-            + "_"
-            + self.CRAWL_SUBJECT
-            + "_"
-            + datetime.now().strftime("%Y%m%d-%H%M%S")
+            self.crawl_name + "_" + datetime.now().strftime("%Y%m%d-%H%M%S")
         )
         os.mkdir(self.result_dir)
 
         # Version file
         with open(
-            self.result_dir + "/version.txt", "w", encoding="utf-8"
+            self.result_path("version.txt"), "w", encoding="utf-8"
         ) as version_file:
             version_file.write(franck.__version__)
 
         # Load balacing
         self.concurrent_connection_sem = asyncio.Semaphore(self.NB_SEMAPHORE)
-
-        # CSV locks
-        self.csvs: Dict[str, Tuple[asyncio.Lock, TextIOWrapper, DictWriter]] = {}
+        self.host_connection_sems: Dict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.NB_HOST_SEMAPHORE)
+        )
+        # NB: delay (in seconds) before the next query to an instance throttling us
+        self.host_backoffs: Dict[str, float] = {}
+        # NB: earliest time (event loop clock) of the next query to an instance
+        self.host_next_queries: Dict[str, float] = {}
+        # NB: the queries use HTTPS, except for the instances refusing it
+        self.http_only_hosts: Set[str] = set()
+        self.https_probed_hosts: Set[str] = set()
+        self.https_probe_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+        # CSV files (each one is written by a dedicated task fed by a queue)
+        # NB: rows are written as tuples following the order of the CSV fields
+        self.csvs: Dict[str, Tuple[asyncio.Queue, TextIOWrapper, Any]] = {}
+        self.csv_fields: Dict[str, List[str]] = {}
         self.csv_information: List[Tuple[str, List[str]]] = []
+        self.csv_writer_tasks: List[asyncio.Task] = []
+        self.csv_writer_error: Optional[Exception] = None
 
         # Initialize HTTP session
-        aiohttp_session = aiohttp.ClientSession(
-            headers={"User-Agent": "Fediverse Graph Crawler (Academic Research)"}
-        )
-        retry_options = ExponentialRetry(attempts=3)
-        self.session = RetryClient(
-            client_session=aiohttp_session, retry_options=retry_options
+        # NB: a session can be shared by consecutive crawlers (e.g., the
+        #   federation and community crawls of Lemmy) to reuse its connections.
+        self.owns_session = session is None
+        self.session = self.create_session() if session is None else session
+        self.response_cache = (
+            None
+            if self.RESPONSE_CACHE_DIR is None
+            else ResponseCache(self.RESPONSE_CACHE_DIR)
         )
 
-        self.crawled_instances = set(urls)
+        # NB: hostnames are case-insensitive, the variants of a host are crawled once
+        self.crawled_instances = {
+            url.strip().lower().rstrip("/") for url in urls if url and url.strip()
+        }
 
         # Setup the logger
-        self.logger = colorlog.getLogger(self.SOFTWARE + "_" + self.CRAWL_SUBJECT)
+        self.logger = colorlog.getLogger(self.crawl_name)
         self.logger.setLevel(logging.DEBUG)
+        # NB: the file handler is specific to each crawl, so it cannot be reused
+        for old_handler in self.logger.handlers:
+            old_handler.close()
         self.logger.handlers = []  # Reset handlers
         handler = colorlog.StreamHandler()
         handler.setFormatter(
@@ -147,12 +327,7 @@ class Crawler:
         handler.setLevel(logging.INFO)
         self.logger.addHandler(handler)
         fhandler = logging.FileHandler(
-            self.result_dir
-            + "/crawl_"
-            + self.SOFTWARE
-            + "_"
-            + self.CRAWL_SUBJECT
-            + ".log"
+            self.result_path("crawl_" + self.crawl_name + ".log")
         )
         fhandler.setFormatter(
             logging.Formatter("[%(asctime)s %(levelname)s] %(message)s")
@@ -160,12 +335,139 @@ class Crawler:
         fhandler.setLevel(logging.DEBUG)
         self.logger.addHandler(fhandler)
 
+    @classmethod
+    def create_session(cls) -> RetryClient:
+        """Creates an HTTP session configured for the crawl.
+
+        Returns:
+            RetryClient: HTTP session retrying the transient failures.
+        """
+        # NB: the connector limits match the semaphores, connections are kept
+        #   alive between the queries to an instance and DNS answers are cached.
+        connector = aiohttp.TCPConnector(
+            limit=cls.NB_SEMAPHORE,
+            limit_per_host=cls.NB_HOST_SEMAPHORE,
+            # NB: aiohttp[speedups] provides aiodns, so the lookups are already
+            #   asynchronous. The records expire so that a long crawl follows the
+            #   instances moving to a new IP address.
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            enable_cleanup_closed=True,
+        )
+        aiohttp_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=180, connect=30, sock_read=60),
+            headers={"User-Agent": USER_AGENT},
+        )
+        # NB: only transient failures are retried, an unreachable host still fails fast
+        retry_options = ExponentialRetry(
+            attempts=3,
+            start_timeout=0.5,
+            # NB: 429 and 503 are retried by _request_json, following the host backoff
+            statuses={500, 502, 504},
+            retry_all_server_errors=False,
+            # NB: the body is read after the RetryClient returns, _request_json retries
+            #   the truncated payloads itself.
+            exceptions={aiohttp.ServerDisconnectedError},
+        )
+        return RetryClient(client_session=aiohttp_session, retry_options=retry_options)
+
+    def result_path(self, filename: str) -> str:
+        """Returns the path of a file in the result folder of the crawl."""
+        return os.path.join(self.result_dir, filename)
+
     def _init_csv_file(self, filename, fields):
-        csv_file = open(filename, "w", encoding="utf-8")
-        writer = DictWriter(csv_file, fieldnames=fields)
-        writer.writeheader()
+        csv_file = open(
+            self.result_path(filename),
+            "w",
+            encoding="utf-8",
+            buffering=self.CSV_BUFFER_SIZE,
+        )
+        writer = csv_writer(csv_file)
+        writer.writerow(fields)
         csv_file.flush()
-        self.csvs[filename] = (asyncio.Lock(), csv_file, writer)
+        self.csvs[filename] = (
+            asyncio.Queue(maxsize=self.CSV_QUEUE_SIZE),
+            csv_file,
+            writer,
+        )
+        self.csv_fields[filename] = fields
+        self.csv_writer_tasks.append(
+            asyncio.create_task(self._drain_csv_queue(filename))
+        )
+
+    async def _drain_csv_queue(self, filename):
+        """Writes in a CSV file the batches of rows pushed to its queue.
+
+        All the pending batches are written at once in a worker thread, so the
+        file I/O does not block the event loop. A None batch stops the task.
+        """
+        loop = asyncio.get_running_loop()
+        queue, _file, writer = self.csvs[filename]
+        stop = False
+        while not stop:
+            batches = [await queue.get()]
+            while not queue.empty():
+                batches.append(queue.get_nowait())
+
+            rows = []
+            for batch in batches:
+                if batch is None:
+                    stop = True
+                else:
+                    rows.extend(batch)
+
+            try:
+                if rows:
+                    await loop.run_in_executor(None, writer.writerows, rows)
+            except Exception as err:  # Reported by _flush_csv_files
+                self.logger.error("Cannot write in %s: %s", filename, str(err))
+                if self.csv_writer_error is None:
+                    self.csv_writer_error = err
+            finally:
+                for _ in batches:
+                    queue.task_done()
+
+    async def _write_csv_rows(self, filename: str, rows: List[Dict[str, Any]]):
+        """Pushes a batch of rows to the writer of a CSV file.
+
+        Missing fields are left empty and unknown keys are ignored.
+
+        Args:
+            filename (str): name of the CSV file
+            rows (List[Dict[str, Any]]): rows to write
+        """
+        fields = self.csv_fields[filename]
+        await self._write_csv_tuples(
+            filename, [tuple(map(row.get, fields)) for row in rows]
+        )
+
+    async def _write_csv_tuples(self, filename: str, rows: List[Tuple]):
+        """Pushes a batch of rows, given in the order of the CSV fields.
+
+        NB: waits if the writer task lags behind (bounded queue).
+
+        Args:
+            filename (str): name of the CSV file
+            rows (List[Tuple]): rows to write
+        """
+        if rows:
+            await self.csvs[filename][0].put(rows)
+
+    async def _flush_csv_files(self):
+        """Waits for all the pending rows to be written and flushes the files.
+
+        Raises:
+            CrawlerException: if some rows could not be written.
+        """
+        for queue, csv_file, _writer in self.csvs.values():
+            await queue.join()
+            csv_file.flush()
+
+        if self.csv_writer_error is not None:
+            raise CrawlerException(
+                f"Cannot write the CSV files ({self.csv_writer_error})"
+            )
 
     def init_all_files(self):
         for filename, fields in self.csv_information:
@@ -188,57 +490,83 @@ class Crawler:
         assert self.CRAWL_SUBJECT is not None
 
         # Remove temporary files
-        log_file = "crawl_" + self.SOFTWARE + "_" + self.CRAWL_SUBJECT + ".log"
+        log_file = self.result_path("crawl_" + self.crawl_name + ".log")
         os.rename(log_file, log_file + ".to_remove")
 
         for file in self.TEMP_FILES:
+            file = self.result_path(file)
             os.rename(file, file + ".to_remove")
 
         # Remove the unreachable instances
+        # NB: the rows are handled positionally, based on the header of each file
         working_instances = set()
-        with open(self.INSTANCES_CSV, encoding="utf-8") as rawfile, open(
-            "clean_" + self.INSTANCES_CSV, "w", encoding="utf-8"
+        instances_csv = self.result_path(self.INSTANCES_CSV)
+        clean_instances_csv = self.result_path("clean_" + self.INSTANCES_CSV)
+        with open(
+            instances_csv, encoding="utf-8", buffering=self.CSV_BUFFER_SIZE
+        ) as rawfile, open(
+            clean_instances_csv,
+            "w",
+            encoding="utf-8",
+            buffering=self.CSV_BUFFER_SIZE,
         ) as cleanfile:
-            data = DictReader(rawfile)
-            assert self.INSTANCES_CSV_FIELDS is not None
-            writer = DictWriter(cleanfile, fieldnames=self.INSTANCES_CSV_FIELDS)
-            writer.writeheader()
-            for row in data:
-                if row["error"] == "":
-                    working_instances.add(row["host"])
-                    row["Id"] = row["host"]
-                    row["Label"] = row["host"]
+            reader = csv_reader(rawfile)
+            writer = csv_writer(cleanfile)
+            header = next(reader)
+            writer.writerow(header)
+            host_idx = header.index("host")
+            error_idx = header.index("error")
+            id_idx = header.index("Id")
+            label_idx = header.index("Label")
+            for row in reader:
+                if row[error_idx] == "":
+                    host = row[host_idx]
+                    working_instances.add(host)
+                    row[id_idx] = host
+                    row[label_idx] = host
                     writer.writerow(row)
 
-        os.rename(self.INSTANCES_CSV, self.INSTANCES_CSV + ".old.to_remove")
-        os.rename("clean_" + self.INSTANCES_CSV, self.INSTANCES_CSV)
-
-        for interaction_file in self.INTERACTIONS_CSVS:
-            with open(interaction_file, encoding="utf-8") as rawfile, open(
-                "clean_" + interaction_file, "w", encoding="utf-8"
+        os.rename(instances_csv, instances_csv + ".old.to_remove")
+        os.rename(clean_instances_csv, instances_csv)
+
+        for interaction_csv in self.INTERACTIONS_CSVS:
+            interaction_file = self.result_path(interaction_csv)
+            clean_interaction_file = self.result_path("clean_" + interaction_csv)
+            with open(
+                interaction_file, encoding="utf-8", buffering=self.CSV_BUFFER_SIZE
+            ) as rawfile, open(
+                clean_interaction_file,
+                "w",
+                encoding="utf-8",
+                buffering=self.CSV_BUFFER_SIZE,
             ) as cleanfile:
-                data = DictReader(rawfile)
-                writer = DictWriter(cleanfile, fieldnames=self.INTERACTIONS_CSV_FIELDS)
-                writer.writeheader()
-                for row in data:
-                    if (
-                        row["Source"] in working_instances
-                        and row["Target"] in working_instances
-                    ):
-                        writer.writerow(row)
+                reader = csv_reader(rawfile)
+                writer = csv_writer(cleanfile)
+                header = next(reader)
+                writer.writerow(header)
+                source_idx = header.index("Source")
+                target_idx = header.index("Target")
+                writer.writerows(
+                    row
+                    for row in reader
+                    if row[source_idx] in working_instances
+                    and row[target_idx] in working_instances
+                )
 
             os.rename(interaction_file, interaction_file + ".old.to_remove")
-            os.rename("clean_" + interaction_file, interaction_file)
+            os.rename(clean_interaction_file, interaction_file)
 
-    async def __inspect_instance_with_logging(self, url):
-        self.logger.debug("Start inspecting instance %s", url)
-        await self.inspect_instance(url)
-        self.logger.debug("Finished inspecting instance %s", url)
+    async def __inspection_worker(self, hosts: Iterator[str], progress_bar: tqdm):
+        # NB: the workers share the same iterator, so each host is inspected once
+        for host in hosts:
+            self.logger.debug("Start inspecting instance %s", host)
+            await self.inspect_instance(host)
+            self.logger.debug("Finished inspecting instance %s", host)
+            progress_bar.update(1)
 
     async def launch(self):
         """Launch the crawl"""
 
-        os.chdir(self.result_dir)
         self.init_all_files()
 
         if not self.crawled_instances:
@@ -247,43 +575,58 @@ class Crawler:
         self.logger.info("Crawl begins...")
 
         try:
-            tasks = [
-                self.__inspect_instance_with_logging(url)
-                for url in self.crawled_instances
-            ]
-
-            for task in tqdm.as_completed(
-                tasks, desc=f"Crawling {self.SOFTWARE} ({self.CRAWL_SUBJECT})"
-            ):
-                await task
-            for _lock, csv_file, _writer in self.csvs.values():
-                csv_file.flush()
+            # NB: a fixed pool of workers avoids creating one coroutine per host
+            hosts = iter(list(self.crawled_instances))
+            nb_workers = min(self.NB_INSPECTION_WORKERS, len(self.crawled_instances))
+            with tqdm(
+                total=len(self.crawled_instances),
+                desc=f"Crawling {self.SOFTWARE} ({self.CRAWL_SUBJECT})",
+            ) as progress_bar:
+                workers = [
+                    asyncio.create_task(self.__inspection_worker(hosts, progress_bar))
+                    for _ in range(nb_workers)
+                ]
+                try:
+                    await asyncio.gather(*workers)
+                except BaseException:
+                    # NB: the other workers are stopped (and awaited) before the
+                    #   CSV writers and the session are closed.
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    raise
+            await self._flush_csv_files()
 
             self.logger.info("Crawl completed!!!")
             self.logger.info("Processing the data...")
 
             self.data_postprocessing()
+            await self._flush_csv_files()
             self.data_cleaning()
 
-            Crawler.compress_csv_files()
+            Crawler.compress_csv_files(self.result_dir)
         except Exception as err:
             err_msg = str(err)
             self.logger.error("Crawl failed: %s", err_msg)
-            os.chdir("../")
             raise err
         self.logger.info("Done.")
-        os.chdir("../")
 
     async def close(self):
-        await self.session.close()
-        for _lock, file, _writer in self.csvs.values():
+        if self.owns_session:
+            await self.session.close()
+        for queue, _file, _writer in self.csvs.values():
+            await queue.put(None)
+        await asyncio.gather(*self.csv_writer_tasks)
+        for _queue, file, _writer in self.csvs.values():
             file.close()
+        for handler in self.logger.handlers:
+            handler.close()
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, *args, **kwargs):
-        await self.session.close()
+        await self.close()
 
     async def _fetch_json(
         self,
@@ -291,12 +634,14 @@ class Crawler:
         params: Optional[Mapping[str, Union[str, int]]] = None,
         body=None,
         op="GET",
+        ttl: float = 0,
     ) -> Dict[str, Any]:
         """Query an instance API and returns the resulting JSON.
 
         Args:
             url (str): URL of the API endpoint
             params (Optional[Mapping[str, str]], optional): parameters of the HTTP query. Defaults to None.
+            ttl (float, optional): validity (in seconds) of a cached response. Defaults to 0 (no cache).
 
         Raises:
             CrawlerException: if the HTTP request fails.
@@ -304,49 +649,196 @@ class Crawler:
         Returns:
             Dict: dictionary containing the JSON response.
         """
-        self.logger.debug(
-            "Fetching %s [params:%s] [body:%s]", url, str(params), str(body)
-        )
+        loop = asyncio.get_running_loop()
+        cache_key = None
+        if ttl and self.response_cache is not None:
+            cache_key = orjson.dumps([op, url, params, body])
+            # NB: the (de)compression and the file I/O run in a worker thread
+            data = await loop.run_in_executor(
+                None, self.response_cache.get, cache_key, ttl
+            )
+            if data is not None:
+                self.logger.debug("Cache hit for %s [params:%s]", url, params)
+                return data
 
-        async with self.concurrent_connection_sem:
+        data, _headers = await self._query_json(url, params, body, op)
+        if cache_key is not None:
             try:
-                if op == "GET":
-                    req_func = self.session.get
-                elif op == "POST":
-                    req_func = self.session.post
-                else:
-                    raise NotImplementedError
+                await loop.run_in_executor(
+                    None, self.response_cache.put, cache_key, data
+                )
+            except OSError as err:  # The crawl does not depend on the cache
+                self.logger.warning("Cannot cache the response of %s: %s", url, err)
+        return data
+
+    async def _query_json(
+        self,
+        url: str,
+        params: Optional[Mapping[str, Union[str, int]]] = None,
+        body=None,
+        op: str = "GET",
+    ) -> Tuple[Any, Mapping[str, str]]:
+        """Queries an instance API over HTTPS, or HTTP if the instance refuses HTTPS.
 
-                async with req_func(url, timeout=180, params=params, json=body) as resp:
-                    if resp.status != 200:
+        Args:
+            url (str): URL of the API endpoint
+            params (Optional[Mapping[str, str]], optional): parameters of the HTTP query. Defaults to None.
+
+        Raises:
+            CrawlerException: if the HTTP request fails.
+
+        Returns:
+            Tuple[Any, Mapping[str, str]]: JSON response and headers of the response.
+        """
+        host = url_netloc(url)
+        if url.startswith("https://"):
+            if host not in self.https_probed_hosts:
+                # NB: only the first query to an instance probes HTTPS, the
+                #   concurrent queries wait for its outcome instead.
+                async with self.https_probe_locks[host]:
+                    if host not in self.https_probed_hosts:
                         try:
-                            err_data = await resp.read()
-                        except aiohttp.ClientResponseError:
-                            err_data = "Cannot read the response data"
-                        err_msg = f"Error code {str(resp.status)} on {url}"
-                        self.logger.error(err_msg)
-                        self.logger.debug("Error response: %s", err_data)
-                        raise CrawlerException(err_msg)
-                    data = await resp.read()
+                            return await self._request_json(host, url, params, body, op)
+                        except CrawlerException as err:
+                            if not https_unavailable(err.__cause__):
+                                raise
+                            # NB: some legacy instances are only served over plain HTTP
+                            self.logger.debug(
+                                "Falling back to HTTP for %s (%s)", host, err
+                            )
+                            self.http_only_hosts.add(host)
+                        finally:
+                            self.https_probed_hosts.add(host)
+                            del self.https_probe_locks[host]
+            if host in self.http_only_hosts:
+                url = "http://" + url[len("https://") :]
+        return await self._request_json(host, url, params, body, op)
+
+    async def _request_json(
+        self,
+        host: str,
+        url: str,
+        params: Optional[Mapping[str, Union[str, int]]],
+        body,
+        op: str,
+    ) -> Tuple[Any, Mapping[str, str]]:
+        self.logger.debug("Fetching %s [params:%s] [body:%s]", url, params, body)
+
+        if op == "GET":
+            req_func = self.session.get
+        elif op == "POST":
+            req_func = self.session.post
+        else:
+            raise NotImplementedError
+
+        # NB: the host semaphore is acquired first so that a query waiting for
+        #   its instance does not hold one of the global connection slots.
+        async with self.host_connection_sems[host]:
+            for attempt in range(1, self.NB_QUERY_ATTEMPTS + 1):
+                await self._wait_host_turn(host)
+                async with self.concurrent_connection_sem:
                     try:
-                        return json.loads(data)
-                    except (json.JSONDecodeError, UnicodeDecodeError) as err:
+                        async with req_func(url, params=params, json=body) as resp:
+                            throttled = self._update_host_backoff(host, resp)
+                            if throttled and attempt < self.NB_QUERY_ATTEMPTS:
+                                self.logger.debug(
+                                    "Code %d on %s, retrying after the backoff",
+                                    resp.status,
+                                    url,
+                                )
+                                continue
+                            if resp.status != 200:
+                                try:
+                                    err_data = await resp.read()
+                                except aiohttp.ClientResponseError:
+                                    err_data = "Cannot read the response data"
+                                self.logger.error(
+                                    "Error code %d on %s", resp.status, url
+                                )
+                                self.logger.debug("Error response: %s", err_data)
+                                raise CrawlerException(
+                                    "Error code", resp.status, "on", url
+                                )
+                            try:
+                                data = await resp.read()
+                            except aiohttp.ClientPayloadError:
+                                if attempt < self.NB_QUERY_ATTEMPTS:
+                                    self.logger.debug(
+                                        "Truncated response on %s, retrying", url
+                                    )
+                                    continue
+                                raise
+                            try:
+                                return orjson.loads(data), resp.headers
+                            except orjson.JSONDecodeError as err:
+                                raise CrawlerException(
+                                    f"Cannot decode JSON on {url} ({err})"
+                                ) from err
+                    except aiohttp.ClientError as err:
+                        raise CrawlerException(err) from err
+                    except asyncio.TimeoutError as err:
                         raise CrawlerException(
-                            f"Cannot decode JSON on {url} ({err})"
+                            "Connection to", url, "timed out"
                         ) from err
-            except aiohttp.ClientError as err:
-                raise CrawlerException(f"{err}") from err
-            except asyncio.TimeoutError as err:
-                raise CrawlerException(f"Connection to {url} timed out") from err
-            except ValueError as err:
-                if err.args[0] == "Can redirect only to http or https":
-                    raise CrawlerException("Invalid redirect") from err
-                raise
+                    except ValueError as err:
+                        if err.args[0] == "Can redirect only to http or https":
+                            raise CrawlerException("Invalid redirect") from err
+                        raise
+
+    async def _wait_host_turn(self, host: str):
+        """Waits until the next query to an instance is allowed.
+
+        The queries to an instance are spaced by MIN_DELAY_PER_HOST, or by its
+        backoff delay if the instance recently throttled the crawler.
+
+        Args:
+            host (str): instance to query
+        """
+        # NB: the slot is reserved before sleeping (no await in between), so
+        #   concurrent queries to the same instance are spaced without a lock.
+        now = asyncio.get_running_loop().time()
+        query_time = max(now, self.host_next_queries.get(host, now))
+        spacing = max(self.MIN_DELAY_PER_HOST, self.host_backoffs.get(host, 0.0))
+        self.host_next_queries[host] = query_time + spacing
+        if query_time > now:
+            await asyncio.sleep(query_time - now)
+
+    def _update_host_backoff(self, host: str, resp: aiohttp.ClientResponse) -> bool:
+        """Adapts the delay between the queries to an instance to its last answer.
+
+        The delay doubles (or follows the Retry-After header) each time the instance
+        throttles the crawler and halves after each successful query.
+
+        Args:
+            host (str): instance queried
+            resp (aiohttp.ClientResponse): response of the instance
+
+        Returns:
+            bool: whether the instance throttled the query.
+        """
+        delay = self.host_backoffs.get(host, 0.0)
+        if resp.status in self.THROTTLING_STATUSES:
+            retry_after = resp.headers.get("Retry-After", "")
+            # NB: Retry-After can also be an HTTP date, we then rely on the doubling
+            min_delay = float(retry_after) if retry_after.isdigit() else 1.0
+            delay = min(self.MAX_HOST_BACKOFF, max(2 * delay, min_delay))
+            self.host_backoffs[host] = delay
+            # NB: the queries already scheduled also wait for the new delay
+            now = asyncio.get_running_loop().time()
+            self.host_next_queries[host] = max(
+                self.host_next_queries.get(host, now), now + delay
+            )
+            return True
+
+        if delay:
+            if delay > 0.1:
+                self.host_backoffs[host] = delay / 2
+            else:
+                del self.host_backoffs[host]
+        return False
 
     async def _write_instance_csv(self, instance_dict):
-        lock, _file, writer = self.csvs[self.INSTANCES_CSV]
-        async with lock:
-            writer.writerow(instance_dict)
+        await self._write_csv_rows(self.INSTANCES_CSV, [instance_dict])
 
     async def _write_connected_instance(
         self,
@@ -354,27 +846,71 @@ class Crawler:
         connected_instances: List[str],
         blocked_instances: Optional[List[str]] = None,
     ):
+        # NB: hostnames are case-insensitive and a blocked instance may also be
+        #   listed as connected, only the block is kept in this case.
+        #   The instances outside the crawl are dropped by a single intersection.
+        blocked = (
+            set()
+            if blocked_instances is None
+            else {dest.lower() for dest in blocked_instances} & self.crawled_instances
+        )
+        connected = (
+            {dest.lower() for dest in connected_instances} & self.crawled_instances
+        ) - blocked
+        links = [(host, dest, 1) for dest in connected]
+        links += [(host, dest, -1) for dest in blocked]
+        await self._write_links(links)
+
+    async def _write_links(self, links: Iterable[Tuple[str, str, int]]):
+        """Writes (source, target, weight) links in the interactions CSV.
+
+        Links with an instance outside the crawl are dropped.
+
+        Args:
+            links (Iterable[Tuple[str, str, int]]): links to write
+        """
         assert len(self.INTERACTIONS_CSVS) == 1
-        lock, _file, writer = self.csvs[self.INTERACTIONS_CSVS[0]]
-        async with lock:
-            for dest in set(connected_instances):
-                if dest in self.crawled_instances:  # Minimizes the cleaning necessary
-                    writer.writerow({"Source": host, "Target": dest, "Weight": 1})
-
-            if blocked_instances is not None:
-                for dest in set(blocked_instances):
-                    if (
-                        dest in self.crawled_instances
-                    ):  # Minimizes the cleaning necessary
-                        writer.writerow({"Source": host, "Target": dest, "Weight": -1})
+        rows = []
+        for link in links:
+            source, target, _weight = link
+            if (
+                source in self.crawled_instances and target in self.crawled_instances
+            ):  # Minimizes the cleaning necessary
+                rows.append(link)
+
+        await self._write_csv_tuples(self.INTERACTIONS_CSVS[0], rows)
 
     @staticmethod
-    def compress_csv_files():
-        for fname in glob.glob("*.csv"):
+    def compress_csv_files(result_dir: str):
+        for fname in glob.glob(os.path.join(result_dir, "*.csv")):
             dataframe = pd.read_csv(fname)
             dataframe.to_parquet(fname[:-4] + ".parquet")
 
 
+@asynccontextmanager
+async def crawl_session(
+    session: Optional[RetryClient] = None,
+) -> AsyncIterator[RetryClient]:
+    """Provides the HTTP session of one or several consecutive crawls.
+
+    Args:
+        session (Optional[RetryClient]): session to reuse. Defaults to None
+            (a session is created and closed on exit).
+
+    Yields:
+        RetryClient: HTTP session to share between the crawlers.
+    """
+    if session is not None:
+        yield session
+        return
+
+    session = Crawler.create_session()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
 class FederationCrawler(Crawler):
     """Abstract class for crawler exploring a federation of instances.
 
@@ -385,8 +921,8 @@ class FederationCrawler(Crawler):
 
     CRAWL_SUBJECT = "federation"
 
-    def __init__(self, urls: List[str]):
-        super().__init__(urls)
+    def __init__(self, urls: List[str], session: Optional[RetryClient] = None):
+        super().__init__(urls, session)
         assert len(self.INTERACTIONS_CSVS) == 1
         self.csv_information = [
             (self.INSTANCES_CSV, self.INSTANCES_CSV_FIELDS),
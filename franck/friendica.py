@@ -3,11 +3,10 @@
 from .common import (
     CrawlerException,
     FederationCrawler,
+    crawl_session,
     fetch_fediverse_instance_list,
 )
 
-DELAY_BETWEEN_CONSECUTIVE_REQUESTS = 0.2
-
 
 class FriendicaFederationCrawler(FederationCrawler):
     SOFTWARE = "friendica"
@@ -27,14 +26,16 @@ class FriendicaFederationCrawler(FederationCrawler):
         instance_dict = {"host": host}
         connected_instances = []
         try:
-            info_dict = await self._fetch_json("http://" + host + "/api/v1/instance")
+            info_dict = await self._fetch_json(
+                "https://" + host + "/api/v1/instance", ttl=self.METADATA_CACHE_TTL
+            )
             instance_dict["version"] = info_dict["version"]
             instance_dict["users"] = info_dict["stats"]["user_count"]
             instance_dict["statuses"] = info_dict["stats"]["status_count"]
             instance_dict["registration_enabled"] = info_dict["registrations"]
 
             connected_instances = list(
-                await self._fetch_json("http://" + host + "/api/v1/instance/peers")
+                await self._fetch_json("https://" + host + "/api/v1/instance/peers")
             )
 
         except CrawlerException as err:
@@ -44,8 +45,9 @@ class FriendicaFederationCrawler(FederationCrawler):
         await self._write_connected_instance(host, connected_instances)
 
 
-async def launch_friendica_crawl():
-    start_urls = await fetch_fediverse_instance_list("friendica")
+async def launch_friendica_crawl(session=None):
+    async with crawl_session(session) as session:
+        start_urls = await fetch_fediverse_instance_list("friendica", session)
 
-    async with FriendicaFederationCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with FriendicaFederationCrawler(start_urls, session) as crawler:
+            await crawler.launch()
@@ -1,21 +1,20 @@
 "Lemmy graph crawlers"
 
-import asyncio
-
-from csv import DictWriter, DictReader
-import urllib.parse
+from csv import reader as csv_reader
 
+import numpy as np
+import pandas as pd
 import scipy.sparse as sp
 
 from .common import (
     Crawler,
     CrawlerException,
     FederationCrawler,
+    crawl_session,
     fetch_fediverse_instance_list,
+    url_netloc,
 )
 
-DELAY_BETWEEN_CONSECUTIVE_REQUESTS = 0.2
-
 
 class LemmyFederationCrawler(FederationCrawler):
     SOFTWARE = "lemmy"
@@ -44,12 +43,14 @@ class LemmyFederationCrawler(FederationCrawler):
         blocked_instances = []
 
         try:
-            info_dict = await self._fetch_json("http://" + host + "/api/v3/site")
+            # NB: not cached, older versions return the federated instances (i.e.,
+            #   the edges of the graph) in this response.
+            info_dict = await self._fetch_json("https://" + host + "/api/v3/site")
             instance_dict.update(
                 {
                     key: val
                     for key, val in info_dict["site_view"]["counts"].items()
-                    if key in self.INSTANCES_CSV_FIELDS
+                    if key in self.instances_csv_field_set
                 }
             )
 
@@ -60,7 +61,7 @@ class LemmyFederationCrawler(FederationCrawler):
                     {
                         key: val
                         for key, val in info_dict["site_view"]["site"].items()
-                        if key in self.INSTANCES_CSV_FIELDS
+                        if key in self.instances_csv_field_set
                     }
                 )
             else:
@@ -68,7 +69,7 @@ class LemmyFederationCrawler(FederationCrawler):
                     {
                         key: val
                         for key, val in info_dict["site_view"]["local_site"].items()
-                        if key in self.INSTANCES_CSV_FIELDS
+                        if key in self.instances_csv_field_set
                     }
                 )
 
@@ -88,7 +89,7 @@ class LemmyFederationCrawler(FederationCrawler):
             else:
                 if info_dict["site_view"]["local_site"]["federation_enabled"]:
                     instances_resp = await self._fetch_json(
-                        "http://" + host + "/api/v3/federated_instances",
+                        "https://" + host + "/api/v3/federated_instances",
                     )
 
                     federated_instances = instances_resp["federated_instances"]
@@ -167,13 +168,24 @@ class LemmyCommunityCrawler(Crawler):
     MAX_PAGE_SIZE = 50
 
     def __init__(
-        self, urls, activity_scope="TopMonth", min_active_user_per_community=5
+        self,
+        urls,
+        activity_scope="TopMonth",
+        min_active_user_per_community=5,
+        session=None,
     ):
-        super().__init__(urls)
+        super().__init__(urls, session)
         if activity_scope not in ("TopDay", "TopWeek", "TopMonth"):
             raise CrawlerException("Invalid activity window.")
         self.activity_scope = activity_scope
         self.min_active_user_per_community = min_active_user_per_community
+        # NB: resolved once instead of for each crawled community
+        self.activity_count_key = {
+            "TopDay": "users_active_day",
+            "TopWeek": "users_active_week",
+            "TopMonth": "users_active_month",
+        }[activity_scope]
+        self.community_ownership_field_set = frozenset(self.COMMUNITY_OWNERSHIP_FIELDS)
 
         self.csv_information = [
             (self.INSTANCES_CSV, self.INSTANCES_CSV_FIELDS),
@@ -192,7 +204,7 @@ class LemmyCommunityCrawler(Crawler):
             communities = await self.crawl_community_list(host)
         except CrawlerException as err:
             self.logger.debug(
-                "Error while crawling the community list of %s: %s", host, str(err)
+                "Error while crawling the community list of %s: %s", host, err
             )
             return
 
@@ -212,12 +224,14 @@ class LemmyCommunityCrawler(Crawler):
         instance_dict = {"host": host}
 
         try:
-            info_dict = await self._fetch_json("http://" + host + "/api/v3/site")
+            info_dict = await self._fetch_json(
+                "https://" + host + "/api/v3/site", ttl=self.METADATA_CACHE_TTL
+            )
             instance_dict.update(
                 {
                     key: val
                     for key, val in info_dict["site_view"]["counts"].items()
-                    if key in self.INSTANCES_CSV_FIELDS
+                    if key in self.instances_csv_field_set
                 }
             )
 
@@ -228,7 +242,7 @@ class LemmyCommunityCrawler(Crawler):
                     {
                         key: val
                         for key, val in info_dict["site_view"]["site"].items()
-                        if key in self.INSTANCES_CSV_FIELDS
+                        if key in self.instances_csv_field_set
                     }
                 )
             else:
@@ -236,7 +250,7 @@ class LemmyCommunityCrawler(Crawler):
                     {
                         key: val
                         for key, val in info_dict["site_view"]["local_site"].items()
-                        if key in self.INSTANCES_CSV_FIELDS
+                        if key in self.instances_csv_field_set
                     }
                 )
 
@@ -253,6 +267,7 @@ class LemmyCommunityCrawler(Crawler):
 
     async def crawl_community_list(self, host):
         local_communities = []
+        list_url = "https://" + host + "/api/v3/community/list"
 
         page = 1
         crawl_over = False
@@ -263,9 +278,7 @@ class LemmyCommunityCrawler(Crawler):
                 "type_": "Local",
                 "sort": self.activity_scope,
             }
-            resp = await self._fetch_json(
-                "http://" + host + "/api/v3/community/list", params=params
-            )
+            resp = await self._fetch_json(list_url, params=params)
 
             if not resp["communities"]:
                 break
@@ -275,27 +288,14 @@ class LemmyCommunityCrawler(Crawler):
                 current_community = {
                     key: val
                     for key, val in community["counts"].items()
-                    if key in self.COMMUNITY_OWNERSHIP_FIELDS
+                    if key in self.community_ownership_field_set
                 }
                 current_community["instance"] = host
                 current_community["community"] = community["community"]["name"]
 
                 if (
-                    (
-                        self.activity_scope == "TopDay"
-                        and current_community["users_active_day"]
-                        < self.min_active_user_per_community
-                    )
-                    or (
-                        self.activity_scope == "TopWeek"
-                        and current_community["users_active_week"]
-                        < self.min_active_user_per_community
-                    )
-                    or (
-                        self.activity_scope == "TopMonth"
-                        and current_community["users_active_month"]
-                        < self.min_active_user_per_community
-                    )
+                    current_community[self.activity_count_key]
+                    < self.min_active_user_per_community
                 ):
                     crawl_over = True
                     break
@@ -303,21 +303,18 @@ class LemmyCommunityCrawler(Crawler):
                 new_communities.append(current_community)
                 local_communities.append(community["community"]["name"])
 
-            lock, _file, writer = self.csvs[self.COMMUNITY_OWNERSHIP_CSV]
-            async with lock:
-                for community_dict in new_communities:
-                    writer.writerow(community_dict)
+            await self._write_csv_rows(self.COMMUNITY_OWNERSHIP_CSV, new_communities)
 
             if len(resp["communities"]) < self.MAX_PAGE_SIZE:
                 break
 
             page += 1
-            await asyncio.sleep(DELAY_BETWEEN_CONSECUTIVE_REQUESTS)
         return local_communities
 
     async def crawl_community_posts(self, host, community):
         page = 1
         total_posts = 0
+        posts_url = "https://" + host + "/api/v3/post/list"
 
         crawl_over = False
         while not crawl_over:
@@ -327,9 +324,7 @@ class LemmyCommunityCrawler(Crawler):
                 "sort": self.activity_scope,
                 "community_name": community,
             }
-            resp = await self._fetch_json(
-                "http://" + host + "/api/v3/post/list", params=params
-            )
+            resp = await self._fetch_json(posts_url, params=params)
 
             if not resp["posts"]:
                 break
@@ -340,19 +335,14 @@ class LemmyCommunityCrawler(Crawler):
                     "community": community + "@" + host,
                     "community_instance": host,
                 }
-                current["user_instance"] = urllib.parse.urlparse(
-                    post["creator"]["actor_id"]
-                ).netloc
+                current["user_instance"] = url_netloc(post["creator"]["actor_id"])
                 current["username"] = post["creator"]["name"]
                 current["post_id"] = post["post"]["ap_id"]
 
                 if current["user_instance"] in self.crawled_instances:
                     new_posts.append(current)
 
-            lock, _file, writer = self.csvs[self.DETAILED_INTERACTIONS_CSV]
-            async with lock:
-                for post_dict in new_posts:
-                    writer.writerow(post_dict)
+            await self._write_csv_rows(self.DETAILED_INTERACTIONS_CSV, new_posts)
 
             total_posts += len(resp["posts"])
 
@@ -360,108 +350,130 @@ class LemmyCommunityCrawler(Crawler):
                 break
 
             page += 1
-            await asyncio.sleep(DELAY_BETWEEN_CONSECUTIVE_REQUESTS)
 
     def data_postprocessing(self):
-        # NB: No concurrent tasks so we do not need the locks
+        # NB: No concurrent tasks so we can use the CSV writers directly
+        #   (rows are tuples following the order of the CSV fields)
         community_list = []
         community_dict = {}
 
         instance_list = []
         instance_dict = {}
 
-        with open(self.COMMUNITY_OWNERSHIP_CSV, "r", encoding="utf-8") as csv_file:
-            reader = DictReader(csv_file, fieldnames=self.COMMUNITY_OWNERSHIP_FIELDS)
+        # NB: the matrices are built from COO triplets (instead of incremental
+        #   updates), the duplicated entries are summed by scipy.
+        owner_instance_inds = []
+
+        instance_idx = self.COMMUNITY_OWNERSHIP_FIELDS.index("instance")
+        community_idx = self.COMMUNITY_OWNERSHIP_FIELDS.index("community")
+        with open(
+            self.result_path(self.COMMUNITY_OWNERSHIP_CSV),
+            "r",
+            encoding="utf-8",
+            buffering=self.CSV_BUFFER_SIZE,
+        ) as csv_file:
+            reader = csv_reader(csv_file)
             next(reader, None)  # Skip the csv header
             for row in reader:
-                instance_ind = -1
-                if row["instance"] in instance_dict:
-                    instance_ind = instance_dict[row["instance"]]
-                else:
-                    instance_ind = len(instance_list)
-                    instance_dict[row["instance"]] = instance_ind
-                    instance_list.append(row["instance"])
+                instance = row[instance_idx]
+                # NB: a new instance gets the next index with a single dict lookup
+                instance_ind = instance_dict.setdefault(instance, len(instance_list))
+                if instance_ind == len(instance_list):
+                    instance_list.append(instance)
 
                 community_ind = len(community_list)
-                community_full_name = row["community"] + "@" + row["instance"]
+                community_full_name = row[community_idx] + "@" + instance
                 community_dict[community_full_name] = (community_ind, instance_ind)
                 community_list.append(community_full_name)
-
-        ownership_mat = sp.dok_matrix(
-            (len(community_list), len(instance_list)), dtype=int
+                owner_instance_inds.append(instance_ind)
+
+        # NB: each community (row) has exactly one owner instance (column)
+        ownership_mat = sp.csr_matrix(
+            (
+                np.ones(len(community_list), dtype=np.int8),
+                (np.arange(len(community_list)), owner_instance_inds),
+            ),
+            shape=(len(community_list), len(instance_list)),
         )
-        for community_ind, instance_ind in community_dict.values():
-            ownership_mat[community_ind, instance_ind] = 1
 
-        interaction_mat = sp.dok_matrix(
-            (len(instance_list), len(community_list)), dtype=int
+        # NB: the posts are mapped to matrix indices column-wise by pandas
+        posts = pd.read_csv(
+            self.result_path(self.DETAILED_INTERACTIONS_CSV),
+            usecols=["user_instance", "community", "post_id"],
+            dtype=str,
+            keep_default_na=False,
+        )
+        user_instance_inds = posts["user_instance"].map(instance_dict)
+        unknown_instances = user_instance_inds.isna()
+        for post_id, instance, community in posts.loc[
+            unknown_instances, ["post_id", "user_instance", "community"]
+        ].itertuples(index=False):
+            self.logger.debug(
+                "Ignoring post %s: instance unknown %s (community %s)",
+                post_id,
+                instance,
+                community,
+            )
+        known_posts = ~unknown_instances
+        community_inds = posts.loc[known_posts, "community"].map(
+            {name: inds[0] for name, inds in community_dict.items()}
         )
 
-        with open(self.DETAILED_INTERACTIONS_CSV, "r", encoding="utf-8") as csv_file:
-            reader = DictReader(csv_file, fieldnames=self.DETAILED_INTERACTIONS_FIELDS)
-            next(reader, None)  # Skip the CSV header
-            for post_dict in reader:
-                instance = post_dict["user_instance"]
-                community = post_dict["community"]
-                try:
-                    user_instance_ind = instance_dict[instance]
-                except KeyError:
-                    self.logger.debug(
-                        "Ignoring post %s: instance unknown %s (community %s)",
-                        post_dict["post_id"],
-                        instance,
-                        community,
-                    )
-                else:
-                    community_ind = community_dict[community][0]
-                    interaction_mat[user_instance_ind, community_ind] += 1
-
-        intra_instance_mat = sp.coo_matrix(interaction_mat @ ownership_mat)
+        interaction_mat = sp.coo_matrix(
+            (
+                np.ones(len(community_inds), dtype=int),
+                (
+                    user_instance_inds[known_posts].to_numpy(dtype=int),
+                    community_inds.to_numpy(dtype=int),
+                ),
+            ),
+            shape=(len(instance_list), len(community_list)),
+        ).tocsr()
+
+        # NB: the products stay sparse (CSR), they are only converted to COO
+        #   format to iterate over non-zero elements
+        intra_instance_mat = (interaction_mat @ ownership_mat).tocoo()
         bool_interaction_mat = (interaction_mat != 0).astype(int)
-        cross_instance_mat = sp.coo_matrix(
-            bool_interaction_mat @ bool_interaction_mat.T
-        )
-        # NB: convert to COO format to iterate over non-zero elements
+        cross_instance_mat = (bool_interaction_mat @ bool_interaction_mat.T).tocoo()
 
-        community_act_mat = interaction_mat.sum(axis=0)
-        assert community_act_mat.shape == (1, len(community_list))
+        community_act = np.asarray(interaction_mat.sum(axis=0)).ravel()
+        assert community_act.shape == (len(community_list),)
+
+        # NB: the instance names are mapped with a single fancy-indexing per column
+        instance_names = np.array(instance_list, dtype=object)
 
         # Write the community activity CSV
-        _lock, _file, writer = self.csvs[self.COMMUNITY_ACTIVITY_CSV]
-        for community_ind, nb_posts in enumerate(community_act_mat.tolist()[0]):
-            community = community_list[community_ind]
-            instance_ind = community_dict[community][1]
-            writer.writerow(
-                {
-                    "instance": instance_list[instance_ind],
-                    "community": community,
-                    "number_posts": nb_posts,
-                }
+        _queue, _file, writer = self.csvs[self.COMMUNITY_ACTIVITY_CSV]
+        writer.writerows(
+            zip(
+                instance_names[owner_instance_inds].tolist(),
+                community_list,
+                community_act.tolist(),
             )
+        )
 
         # Write the two CSV storing possible weighted graphs between the active instances
         for csv_name, sp_mat in [
             (self.CROSS_INSTANCE_INTERACTIONS_CSV, cross_instance_mat),
             (self.INTRA_INSTANCE_INTERACTIONS_CSV, intra_instance_mat),
         ]:
-            _lock, _file, writer = self.csvs[csv_name]
-            for src_inst_ind, dest_inst_ind, weight in zip(
-                sp_mat.row, sp_mat.col, sp_mat.data
-            ):
-                writer.writerow(
-                    {
-                        "Source": instance_list[src_inst_ind],
-                        "Target": instance_list[dest_inst_ind],
-                        "Weight": weight,
-                    }
+            _queue, _file, writer = self.csvs[csv_name]
+            writer.writerows(
+                zip(
+                    instance_names[sp_mat.row].tolist(),
+                    instance_names[sp_mat.col].tolist(),
+                    sp_mat.data.tolist(),
                 )
+            )
 
 
-async def launch_lemmy_crawl():
-    start_urls = await fetch_fediverse_instance_list("lemmy")
+async def launch_lemmy_crawl(session=None):
+    # NB: both crawls query the same instances, so they share their connections
+    async with crawl_session(session) as session:
+        start_urls = await fetch_fediverse_instance_list("lemmy", session)
 
-    async with LemmyFederationCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with LemmyFederationCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
 
-    async with LemmyCommunityCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with LemmyCommunityCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
@@ -1,23 +1,18 @@
 """Mastodon Graph Crawler"""
 
-import asyncio
-import json
 import re
 
-from csv import DictWriter, DictReader
+from csv import reader as csv_reader
 from typing import Any, Dict, Optional, Tuple
 
-import aiohttp
-
 from .common import (
     Crawler,
     CrawlerException,
     FederationCrawler,
+    crawl_session,
     fetch_fediverse_instance_list,
 )
 
-DELAY_BETWEEN_CONSECUTIVE_REQUESTS = 0.2
-
 
 class MastodonFederationCrawler(FederationCrawler):
     SOFTWARE = "mastodon"
@@ -40,7 +35,9 @@ class MastodonFederationCrawler(FederationCrawler):
         # blocked_instances = []
 
         try:
-            info_dict = await self._fetch_json("http://" + host + "/api/v1/instance")
+            info_dict = await self._fetch_json(
+                "https://" + host + "/api/v1/instance", ttl=self.METADATA_CACHE_TTL
+            )
             instance_dict["version"] = info_dict["version"]
             instance_dict["users"] = info_dict["stats"]["user_count"]
             instance_dict["statuses"] = info_dict["stats"]["status_count"]
@@ -48,7 +45,7 @@ class MastodonFederationCrawler(FederationCrawler):
             instance_dict["registration_enabled"] = info_dict["registrations"]
 
             connected_instances = await self._fetch_json(
-                "http://" + host + "/api/v1/instance/peers"
+                "https://" + host + "/api/v1/instance/peers"
             )
             # blocked_instances = await self._fetch_json(
             #     "http://" + host + "/api/v1/instance/domain_blocks"
@@ -98,8 +95,8 @@ class MastodonActiveUserCrawler(Crawler):
     MAX_PAGE_SIZE = 80
     MAX_ID_REGEX = r"max_id=(\d+)"
 
-    def __init__(self, urls, nb_active_users=10000):
-        super().__init__(urls)
+    def __init__(self, urls, nb_active_users=10000, session=None):
+        super().__init__(urls, session)
 
         self.nb_active_users = nb_active_users
 
@@ -128,44 +125,20 @@ class MastodonActiveUserCrawler(Crawler):
         if "limit" not in params:
             params["limit"] = self.MAX_PAGE_SIZE
 
-        self.logger.debug("Fetching (with pagination) %s [params:%s]", url, str(params))
-
+        data, headers = await self._query_json(url, params)
         next_max_id = None
-        async with self.concurrent_connection_sem:
-            try:
-                async with self.session.get(url, timeout=180, params=params) as resp:
-                    if resp.status != 200:
-                        raise CrawlerException(
-                            f"Error code {str(resp.status)} on {url}"
-                        )
-                    data = await resp.read()
-                    if "Link" in resp.headers and "next" in resp.headers["Link"]:
-                        next_link = resp.headers["Link"].split(",")[
-                            0
-                        ]  # Extract the next page link
-                        max_id_regex = re.search(self.MAX_ID_REGEX, next_link)
-                        next_max_id = max_id_regex.group(1)
-                    try:
-                        return json.loads(data), next_max_id
-                    except (json.JSONDecodeError, UnicodeDecodeError) as err:
-                        raise CrawlerException(
-                            f"Cannot decode JSON on {url} ({err})"
-                        ) from err
-            except aiohttp.ClientError as err:
-                raise CrawlerException(f"{err}") from err
-            except asyncio.TimeoutError as err:
-                raise CrawlerException(f"Connection to {url} timed out") from err
-            except ValueError as err:
-                if err.args[0] == "Can redirect only to http or https":
-                    raise CrawlerException("Invalid redirect") from err
-                raise
+        if "Link" in headers and "next" in headers["Link"]:
+            next_link = headers["Link"].split(",")[0]  # Extract the next page link
+            max_id_regex = re.search(self.MAX_ID_REGEX, next_link)
+            next_max_id = max_id_regex.group(1)
+        return data, next_max_id
 
     async def inspect_instance(self, host):
         try:
             instance_dict = await self._fetch_instance_info(host)
         except CrawlerException as err:
             self.logger.debug(
-                "Error while crawling the information of %s: %s", host, str(err)
+                "Error while crawling the information of %s: %s", host, err
             )
             return
 
@@ -197,7 +170,9 @@ class MastodonActiveUserCrawler(Crawler):
     async def _fetch_instance_info(self, host):
         instance_dict = {"host": host}
         try:
-            info_dict = await self._fetch_json("http://" + host + "/api/v1/instance")
+            info_dict = await self._fetch_json(
+                "https://" + host + "/api/v1/instance", ttl=self.METADATA_CACHE_TTL
+            )
             instance_dict["version"] = info_dict["version"]
             instance_dict["users"] = info_dict["stats"]["user_count"]
             instance_dict["statuses"] = info_dict["stats"]["status_count"]
@@ -210,6 +185,7 @@ class MastodonActiveUserCrawler(Crawler):
 
     async def _crawl_user_list(self, host):
         users = []
+        directory_url = "https://" + host + "/api/v1/directory"
         offset = 0
 
         while len(users) < self.nb_active_users:
@@ -220,9 +196,7 @@ class MastodonActiveUserCrawler(Crawler):
                 "order": "active",
                 "offset": offset,
             }
-            resp = await self._fetch_json(
-                "https://" + host + "/api/v1/directory", params=params
-            )
+            resp = await self._fetch_json(directory_url, params=params)
 
             users.extend(resp)
 
@@ -231,34 +205,34 @@ class MastodonActiveUserCrawler(Crawler):
 
             offset += self.MAX_PAGE_SIZE
 
-            await asyncio.sleep(DELAY_BETWEEN_CONSECUTIVE_REQUESTS)
-
-        lock, _file, writer = self.csvs[self.CRAWLED_USERS_CSV]
-        async with lock:
-            for user in users:
-                writer.writerow(
-                    {
-                        "id": user["id"],
-                        "username": user["username"],
-                        "instance": host,
-                        "followers_count": user["followers_count"],
-                        "following_count": user["following_count"],
-                        "posts_count": user["statuses_count"],
-                    }
-                )
+        await self._write_csv_rows(
+            self.CRAWLED_USERS_CSV,
+            [
+                {
+                    "id": user["id"],
+                    "username": user["username"],
+                    "instance": host,
+                    "followers_count": user["followers_count"],
+                    "following_count": user["following_count"],
+                    "posts_count": user["statuses_count"],
+                }
+                for user in users
+            ],
+        )
 
         return users
 
     async def _crawl_user_interactions(self, host, user_info):
-        follow_dicts = {}
+        # NB: the rows follow the order of CRAWLED_FOLLOWS_FIELDS
+        follows = {}
+        following_url = f"https://{host}/api/v1/accounts/{user_info['id']}/following"
 
         max_id = None
         while True:
             params = {"max_id": max_id} if max_id is not None else None
             try:
                 resp, new_max_id = await self._fetch_json_with_pagination(
-                    f"https://{host}/api/v1/accounts/{user_info['id']}/following",
-                    params=params,
+                    following_url, params=params
                 )
             except AttributeError as err:
                 err_msg = f"Instance {host}: Invalid pagination while crawling user interactions of {user_info}"
@@ -276,20 +250,20 @@ class MastodonActiveUserCrawler(Crawler):
                 if (
                     followee_instance in self.crawled_instances
                 ):  # Avoid adding useless follows that will be cleaned later
-                    follow_dicts[followee_dict["username"]] = {
-                        "followee": followee_dict["username"],
-                        "followee_instance": followee_instance,
-                        "follower": user_info["username"],
-                        "follower_instance": host,
-                    }
-
-            # if len(follow_dicts) > user_info["following_count"]: # Had problems when the users were following/unfollowing during the crawl
+                    follows[followee_dict["username"]] = (
+                        user_info["username"],
+                        host,
+                        followee_dict["username"],
+                        followee_instance,
+                    )
+
+            # if len(follows) > user_info["following_count"]: # Had problems when the users were following/unfollowing during the crawl
             #     raise ValueError(
             #         "Found %s followees instead of %s for user %s",
-            #         len(follow_dicts),
+            #         len(follows),
             #         user_info["following_count"],
             #         user_info["username"],
-            #         list(follow_dicts.keys()),
+            #         list(follows.keys()),
             #     )
 
             if new_max_id is None:
@@ -298,7 +272,7 @@ class MastodonActiveUserCrawler(Crawler):
                     and max_id is None
                     and user_info["following_count"] != 0
                 ):
-                    # NB: we need these "complicated" conditions instead of just checking the size of follow_dicts because we filter some follows
+                    # NB: we need these "complicated" conditions instead of just checking the size of follows because we filter some follows
                     self.logger.debug(
                         "User %s@%s set its follower list as private.",
                         user_info["username"],
@@ -307,44 +281,46 @@ class MastodonActiveUserCrawler(Crawler):
                 break
 
             max_id = new_max_id
-            await asyncio.sleep(DELAY_BETWEEN_CONSECUTIVE_REQUESTS)
 
-        lock, _file, writer = self.csvs[self.CRAWLED_FOLLOWS_CSV]
-        async with lock:
-            for follow in follow_dicts.values():
-                writer.writerow(follow)
+        await self._write_csv_tuples(self.CRAWLED_FOLLOWS_CSV, list(follows.values()))
 
     def data_postprocessing(self):
+        # NB: No concurrent tasks so we can use the CSV writers directly
+        #   (rows are tuples following the order of the CSV fields)
         follows_dict = {}
-        with open(self.CRAWLED_FOLLOWS_CSV, "r", encoding="utf-8") as csv_file:
-            reader = DictReader(csv_file, fieldnames=self.CRAWLED_FOLLOWS_FIELDS)
+        follower_idx = self.CRAWLED_FOLLOWS_FIELDS.index("follower_instance")
+        followee_idx = self.CRAWLED_FOLLOWS_FIELDS.index("followee_instance")
+        with open(
+            self.result_path(self.CRAWLED_FOLLOWS_CSV),
+            "r",
+            encoding="utf-8",
+            buffering=self.CSV_BUFFER_SIZE,
+        ) as csv_file:
+            reader = csv_reader(csv_file)
             next(reader, None)  # Skip the header
             for follow in reader:
-                follower = follow["follower_instance"]
-                followee = follow["followee_instance"]
+                follower = follow[follower_idx]
+                followee = follow[followee_idx]
                 prev_follower = follows_dict.get(follower, {})
                 prev_follower[followee] = prev_follower.get(followee, 0) + 1
                 follows_dict[follower] = prev_follower
 
-        with open(self.INTERACTIONS_CSVS[0], "a", encoding="utf-8") as csv_file:
-            writer = DictWriter(csv_file, fieldnames=self.INTERACTIONS_CSV_FIELDS)
-            for follower, followees_dict in follows_dict.items():
-                for followee, follows_count in followees_dict.items():
-                    writer.writerow(
-                        {
-                            "Source": follower,
-                            "Target": followee,
-                            "Weight": follows_count,
-                        }
-                    )
+        _queue, _file, writer = self.csvs[self.INTERACTIONS_CSVS[0]]
+        for follower, followees_dict in follows_dict.items():
+            writer.writerows(
+                (follower, followee, follows_count)
+                for followee, follows_count in followees_dict.items()
+            )
 
 
-async def launch_mastodon_crawl():
-    start_urls = await fetch_fediverse_instance_list("mastodon")
-    # start_urls = ["mastodon.social", "mastodon.acm.org"]  # FOR DEBUG
+async def launch_mastodon_crawl(session=None):
+    # NB: both crawls query the same instances, so they share their connections
+    async with crawl_session(session) as session:
+        start_urls = await fetch_fediverse_instance_list("mastodon", session)
+        # start_urls = ["mastodon.social", "mastodon.acm.org"]  # FOR DEBUG
 
-    async with MastodonFederationCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with MastodonFederationCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
 
-    async with MastodonActiveUserCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with MastodonActiveUserCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
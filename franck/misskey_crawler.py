@@ -2,19 +2,18 @@
 
 import asyncio
 
-from csv import DictWriter, DictReader
+from csv import reader as csv_reader
 
 from .common import (
     Crawler,
     CrawlerException,
     FederationCrawler,
+    crawl_session,
     fetch_fediverse_instance_list,
+    gather_or_raise,
 )
 
 
-DELAY_BETWEEN_CONSECUTIVE_REQUESTS = 0.2
-
-
 class MisskeyFederationCrawler(FederationCrawler):
     SOFTWARE = "misskey"
     INSTANCES_CSV_FIELDS = [
@@ -35,11 +34,15 @@ class MisskeyFederationCrawler(FederationCrawler):
 
         try:
             stats_dict = await self._fetch_json(
-                "https://" + host + "/api/stats", body={}, op="POST"
+                "https://" + host + "/api/stats",
+                body={},
+                op="POST",
+                ttl=self.METADATA_CACHE_TTL,
             )
             instance_dict["users_count"] = stats_dict["originalUsersCount"]
             instance_dict["posts_count"] = stats_dict["originalNotesCount"]
 
+            instances_url = "https://" + host + "/api/federation/instances"
             offset = 0
             while True:
                 body = {
@@ -47,11 +50,7 @@ class MisskeyFederationCrawler(FederationCrawler):
                     "offset": offset,
                     "sort": "+users",
                 }
-                resp = await self._fetch_json(
-                    "https://" + host + "/api/federation/instances",
-                    body=body,
-                    op="POST",
-                )
+                resp = await self._fetch_json(instances_url, body=body, op="POST")
 
                 new_connected_instances = [
                     inst_dict["host"]
@@ -70,8 +69,6 @@ class MisskeyFederationCrawler(FederationCrawler):
 
                 offset += self.MAX_PAGE_SIZE
 
-                await asyncio.sleep(DELAY_BETWEEN_CONSECUTIVE_REQUESTS)
-
         except CrawlerException as err:
             instance_dict["error"] = str(err)
 
@@ -113,9 +110,10 @@ class MisskeyTopUserCrawler(Crawler):
     TEMP_FILES = [CRAWLED_FOLLOWS_CSV, CRAWLED_USERS_CSV]
 
     MAX_PAGE_SIZE = 100
+    NB_CONCURRENT_USERS = 4  # Maximum number of users crawled at once per instance
 
-    def __init__(self, urls, nb_top_users=1000):
-        super().__init__(urls)
+    def __init__(self, urls, nb_top_users=1000, session=None):
+        super().__init__(urls, session)
 
         self.nb_top_users = nb_top_users
 
@@ -137,30 +135,37 @@ class MisskeyTopUserCrawler(Crawler):
             self.logger.debug(err_msg)
             instance_dict["error"] = err_msg
 
-        for i, user in enumerate(users):
-            self.logger.debug(
-                "Instance %s: %d users out of %d crawled", host, i, len(users)
-            )
-            try:
-                if user["followersCount"] == "?":
-                    self.logger.debug(
-                        "Instance %s: user %s has an unknown number of followers [user ignored]",
-                        host,
-                        user["username"],
-                    )
-                elif user["followersCount"] > 0:
-                    await self._crawl_user_interactions(host, user)
-                else:
-                    raise CrawlerException(
-                        f"Invalid follower count: {user['followersCount']}"
-                    )
-            except CrawlerException as err:
-                err_msg = (
-                    f"Error while crawling the interactions of {user['id']} of {host}: "
-                    + str(err)
+        # NB: the users are crawled concurrently, the host semaphore still bounds
+        #   the number of simultaneous queries to the instance.
+        user_sem = asyncio.Semaphore(self.NB_CONCURRENT_USERS)
+
+        async def crawl_user(i, user):
+            async with user_sem:
+                self.logger.debug(
+                    "Instance %s: %d users out of %d crawled", host, i, len(users)
                 )
-                self.logger.debug(err_msg)
-                instance_dict["error"] = err_msg
+                try:
+                    if user["followersCount"] == "?":
+                        self.logger.debug(
+                            "Instance %s: user %s has an unknown number of followers [user ignored]",
+                            host,
+                            user["username"],
+                        )
+                    elif user["followersCount"] > 0:
+                        await self._crawl_user_interactions(host, user)
+                    else:
+                        raise CrawlerException(
+                            f"Invalid follower count: {user['followersCount']}"
+                        )
+                except CrawlerException as err:
+                    err_msg = (
+                        f"Error while crawling the interactions of {user['id']} of {host}: "
+                        + str(err)
+                    )
+                    self.logger.debug(err_msg)
+                    instance_dict["error"] = err_msg
+
+        await gather_or_raise(*(crawl_user(i, user) for i, user in enumerate(users)))
 
         await self._write_instance_csv(instance_dict)
 
@@ -169,7 +174,10 @@ class MisskeyTopUserCrawler(Crawler):
         instance_dict = {"host": host}
         try:
             stats_dict = await self._fetch_json(
-                "https://" + host + "/api/stats", body={}, op="POST"
+                "https://" + host + "/api/stats",
+                body={},
+                op="POST",
+                ttl=self.METADATA_CACHE_TTL,
             )
 
             instance_dict["users_count"] = stats_dict["originalUsersCount"]
@@ -183,6 +191,7 @@ class MisskeyTopUserCrawler(Crawler):
     async def _crawl_user_list(self, host):
         # https://misskey.io/api/users
         users = []
+        users_url = "https://" + host + "/api/users"
         offset = 0
 
         while len(users) < self.nb_top_users:
@@ -193,9 +202,7 @@ class MisskeyTopUserCrawler(Crawler):
                 "origin": "local",
                 "sort": "+follower",
             }
-            resp = await self._fetch_json(
-                "https://" + host + "/api/users", body=body, op="POST"
-            )
+            resp = await self._fetch_json(users_url, body=body, op="POST")
 
             users.extend(resp)
 
@@ -204,27 +211,28 @@ class MisskeyTopUserCrawler(Crawler):
 
             offset += self.MAX_PAGE_SIZE
 
-            await asyncio.sleep(DELAY_BETWEEN_CONSECUTIVE_REQUESTS)
-
-        lock, _file, writer = self.csvs[self.CRAWLED_USERS_CSV]
-        async with lock:
-            for user in users:
-                writer.writerow(
-                    {
-                        "id": user["id"],
-                        "username": user["username"],
-                        "instance": host,
-                        "followers_count": user["followersCount"],
-                        "following_count": user["followingCount"],
-                        "posts_count": user["notesCount"],
-                        "lang": user.get("lang"),
-                    }
-                )
+        await self._write_csv_rows(
+            self.CRAWLED_USERS_CSV,
+            [
+                {
+                    "id": user["id"],
+                    "username": user["username"],
+                    "instance": host,
+                    "followers_count": user["followersCount"],
+                    "following_count": user["followingCount"],
+                    "posts_count": user["notesCount"],
+                    "lang": user.get("lang"),
+                }
+                for user in users
+            ],
+        )
 
         return users
 
     async def _crawl_user_interactions(self, host, user_info):
-        follow_dicts = []
+        # NB: the rows follow the order of CRAWLED_FOLLOWS_FIELDS
+        follows = []
+        followers_url = "https://" + host + "/api/users/followers"
 
         last_id = "0"
         while True:
@@ -234,22 +242,20 @@ class MisskeyTopUserCrawler(Crawler):
                 "userId": user_info["id"],
                 "host": host,
             }
-            resp = await self._fetch_json(
-                "https://" + host + "/api/users/followers", body=body, op="POST"
-            )
+            resp = await self._fetch_json(followers_url, body=body, op="POST")
 
             host_check = lambda host_input: host if host_input is None else host_input
 
             for follow_dict in resp:
                 follower_instance = host_check(follow_dict["follower"]["host"])
                 if follower_instance in self.crawled_instances:
-                    follow_dicts.append(
-                        {
-                            "follower": follow_dict["follower"]["username"],
-                            "follower_instance": follower_instance,
-                            "followee": user_info["username"],
-                            "followee_instance": host_check(user_info["host"]),
-                        }
+                    follows.append(
+                        (
+                            follow_dict["follower"]["username"],
+                            follower_instance,
+                            user_info["username"],
+                            host_check(user_info["host"]),
+                        )
                     )
 
             if len(resp) < self.MAX_PAGE_SIZE:
@@ -257,44 +263,44 @@ class MisskeyTopUserCrawler(Crawler):
 
             last_id = resp[-1]["id"]
 
-            await asyncio.sleep(DELAY_BETWEEN_CONSECUTIVE_REQUESTS)
-
-        lock, _file, writer = self.csvs[self.CRAWLED_FOLLOWS_CSV]
-        async with lock:
-            for follow in follow_dicts:
-                writer.writerow(follow)
+        await self._write_csv_tuples(self.CRAWLED_FOLLOWS_CSV, follows)
 
     def data_postprocessing(self):
+        # NB: No concurrent tasks so we can use the CSV writers directly
+        #   (rows are tuples following the order of the CSV fields)
         follows_dict = {}
-        with open(self.CRAWLED_FOLLOWS_CSV, "r", encoding="utf-8") as csv_file:
-            reader = DictReader(csv_file, fieldnames=self.CRAWLED_FOLLOWS_FIELDS)
+        follower_idx = self.CRAWLED_FOLLOWS_FIELDS.index("follower_instance")
+        followee_idx = self.CRAWLED_FOLLOWS_FIELDS.index("followee_instance")
+        with open(
+            self.result_path(self.CRAWLED_FOLLOWS_CSV),
+            "r",
+            encoding="utf-8",
+            buffering=self.CSV_BUFFER_SIZE,
+        ) as csv_file:
+            reader = csv_reader(csv_file)
             next(reader, None)  # Skip the header
             for follow in reader:
-                follower = follow["follower_instance"]
-                followee = follow["followee_instance"]
+                follower = follow[follower_idx]
+                followee = follow[followee_idx]
                 prev_follower = follows_dict.get(follower, {})
                 prev_follower[followee] = prev_follower.get(followee, 0) + 1
                 follows_dict[follower] = prev_follower
 
-        with open(self.INTERACTIONS_CSVS[0], "a", encoding="utf-8") as csv_file:
-            writer = DictWriter(csv_file, fieldnames=self.INTERACTIONS_CSV_FIELDS)
-            for follower, followees_dict in follows_dict.items():
-                for followee, follows_count in followees_dict.items():
-                    writer.writerow(
-                        {
-                            "Source": follower,
-                            "Target": followee,
-                            "Weight": follows_count,
-                        }
-                    )
+        _queue, _file, writer = self.csvs[self.INTERACTIONS_CSVS[0]]
+        for follower, followees_dict in follows_dict.items():
+            writer.writerows(
+                (follower, followee, follows_count)
+                for followee, follows_count in followees_dict.items()
+            )
 
 
-async def launch_misskey_crawl():
-    start_urls = await fetch_fediverse_instance_list("misskey")
-    # start_urls = ["pari.cafe", "mi.yumechi.jp", "misskey.io"]  # For debug purpose
+async def launch_misskey_crawl(session=None):
+    async with crawl_session(session) as session:
+        start_urls = await fetch_fediverse_instance_list("misskey", session)
+        # start_urls = ["pari.cafe", "mi.yumechi.jp", "misskey.io"]  # For debug purpose
 
-    async with MisskeyFederationCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with MisskeyFederationCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
 
-    async with MisskeyTopUserCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with MisskeyTopUserCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
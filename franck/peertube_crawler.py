@@ -1,6 +1,14 @@
 "Peertube graph crawler"
-import fileinput
-from .common import CrawlerException, FederationCrawler, fetch_fediverse_instance_list
+
+from typing import List, Set, Tuple
+
+from .common import (
+    CrawlerException,
+    FederationCrawler,
+    crawl_session,
+    fetch_fediverse_instance_list,
+    gather_or_raise,
+)
 
 
 class PeertubeCrawler(FederationCrawler):
@@ -27,81 +35,134 @@ class PeertubeCrawler(FederationCrawler):
         "Label",
     ]
 
+    MAX_PAGE_SIZE = 100
+
+    def __init__(self, urls, session=None):
+        super().__init__(urls, session)
+        # NB: a follow is listed by both of its instances, but written only once
+        self.written_links: Set[Tuple[str, str]] = set()
+
+    def _filter_follow_hosts(self, page: dict, role: str) -> List[str]:
+        return [
+            link_dict[role]["host"]
+            for link_dict in page["data"]
+            if link_dict[role]["name"] == "peertube"  # We avoid Mastodon followers
+        ]
+
+    async def _fetch_follow_hosts(
+        self, url: str, first_page: dict, role: str
+    ) -> List[str]:
+        """Fetches the remaining pages of a follower/following endpoint concurrently.
+
+        Each page is reduced to the hosts of the Peertube instances as soon as
+        it is received, so the full JSON pages are not kept in memory.
+        NB: the per-host semaphore bounds the number of simultaneous queries.
+
+        Args:
+            url (str): URL of the API endpoint
+            first_page (dict): first page of the endpoint (with MAX_PAGE_SIZE follows)
+            role (str): key of the remote instance in a follow ("follower" or "following")
+
+        Raises:
+            CrawlerException: if one of the HTTP requests fails.
+
+        Returns:
+            List[str]: hosts of the Peertube instances involved in the follows.
+        """
+
+        async def fetch_page(start: int) -> List[str]:
+            page = await self._fetch_json(
+                url, params={"count": self.MAX_PAGE_SIZE, "start": start}
+            )
+            return self._filter_follow_hosts(page, role)
+
+        pages = await gather_or_raise(
+            *[
+                fetch_page(i)
+                for i in range(
+                    self.MAX_PAGE_SIZE, first_page["total"], self.MAX_PAGE_SIZE
+                )
+            ]
+        )
+        hosts = self._filter_follow_hosts(first_page, role)
+        return hosts + [host for page in pages for host in page]
+
     async def inspect_instance(self, host: str):
         assert self.INSTANCES_CSV_FIELDS is not None
         instance_dict = {"host": host}
         follower_links = []
         try:
-            # Fetch instance info
+            # Fetch instance info, followers and followees concurrently
             # https://docs.joinpeertube.org/api-rest-reference.html#tag/Stats/operation/getInstanceStats
-            info_dict = await self._fetch_json(
-                "http://" + host + "/api/v1/server/stats"
+            # https://docs.joinpeertube.org/api-rest-reference.html#tag/Instance-Follows/paths/~1api~1v1~1server~1followers/get
+            # https://docs.joinpeertube.org/api-rest-reference.html#tag/Instance-Follows/paths/~1api~1v1~1server~1following/get
+            followers_url = "https://" + host + "/api/v1/server/followers"
+            followees_url = "https://" + host + "/api/v1/server/following"
+            # NB: the first page also provides the total number of follows
+            first_page_params = {"count": self.MAX_PAGE_SIZE, "start": 0}
+            info_dict, config_dict, followers_dict, followees_dict = (
+                await gather_or_raise(
+                    self._fetch_json(
+                        "https://" + host + "/api/v1/server/stats",
+                        ttl=self.METADATA_CACHE_TTL,
+                    ),
+                    self._fetch_json(
+                        "https://" + host + "/api/v1/config",
+                        ttl=self.METADATA_CACHE_TTL,
+                    ),
+                    self._fetch_json(followers_url, params=first_page_params),
+                    self._fetch_json(followees_url, params=first_page_params),
+                )
             )
+
             info_dict = {
                 key: val
                 for key, val in info_dict.items()
-                if key in self.INSTANCES_CSV_FIELDS
+                if key in self.instances_csv_field_set
             }
             instance_dict.update(info_dict)
-
-            config_dict = await self._fetch_json("http://" + host + "/api/v1/config")
             instance_dict["serverVersion"] = config_dict.get("serverVersion", "None")
-
-            # Fetch instance followers
-            # https://docs.joinpeertube.org/api-rest-reference.html#tag/Instance-Follows/paths/~1api~1v1~1server~1followers/get
-            followees_dict = await self._fetch_json(
-                "http://" + host + "/api/v1/server/followers",
-            )
-            instance_dict["totalInstanceFollowers"] = followees_dict["total"]
-            for i in range(0, instance_dict["totalInstanceFollowers"], 100):
-                followers_dict = await self._fetch_json(
-                    "http://" + host + "/api/v1/server/followers",
-                    params={"count": 100, "start": i},
-                )
-                for link_dict in followers_dict["data"]:
-                    if link_dict["follower"]["name"] == "peertube":
-                        # We avoid Mastodon followers
-                        follower_links.append((link_dict["follower"]["host"], host))
-            instance_dict["totalPeertubeInstanceFollowers"] = str(len(follower_links))
-
-            # Fetch instance followees
-            # https://docs.joinpeertube.org/api-rest-reference.html#tag/Instance-Follows/paths/~1api~1v1~1server~1following/get
-            followees_dict = await self._fetch_json(
-                "http://" + host + "/api/v1/server/following",
-            )
+            instance_dict["totalInstanceFollowers"] = followers_dict["total"]
             instance_dict["totalInstanceFollowing"] = followees_dict["total"]
-            for i in range(0, instance_dict["totalInstanceFollowing"], 100):
-                followees_dict = await self._fetch_json(
-                    "http://" + host + "/api/v1/server/following",
-                    params={"count": 100, "start": i},
-                )
-                for link_dict in followees_dict["data"]:
-                    if link_dict["following"]["name"] == "peertube":
-                        # We avoid Mastodon followers
-                        follower_links.append((host, link_dict["following"]["host"]))
-            instance_dict["totalPeertubeInstanceFollowing"] = str(
-                len(follower_links)
-                - int(instance_dict["totalPeertubeInstanceFollowers"])
+
+            followers, followees = await gather_or_raise(
+                self._fetch_follow_hosts(followers_url, followers_dict, "follower"),
+                self._fetch_follow_hosts(followees_url, followees_dict, "following"),
             )
+            follower_links = [(follower, host) for follower in followers]
+            follower_links += [(host, followee) for followee in followees]
+            instance_dict["totalPeertubeInstanceFollowers"] = str(len(followers))
+            instance_dict["totalPeertubeInstanceFollowing"] = str(len(followees))
 
         except CrawlerException as err:
             str_err = str(err)
             instance_dict["error"] = str_err
-            self.logger.debug("Error with instance " + host + " : " + str_err)
+            self.logger.debug("Error with instance %s : %s", host, str_err)
         except KeyError as err:
             str_err = "Missing key in the JSON " + str(err)
             instance_dict["error"] = str_err
-            self.logger.debug("Error with instance " + host + " : " + str_err)
+            self.logger.debug("Error with instance %s : %s", host, str_err)
         except AttributeError as err:
             str_err = "Unexpected aiohttp-related error with " + host + " : " + str(err)
             instance_dict["error"] = str_err
-            self.logger.debug("Error with instance " + host + " : " + str_err)
+            self.logger.debug("Error with instance %s : %s", host, str_err)
 
         await self._write_instance_csv(instance_dict)
-        await self._write_connected_instance(host, follower_links)
+        links = []
+        for follower, followee in follower_links:
+            link = (follower, followee)
+            if (
+                link not in self.written_links
+                and follower in self.crawled_instances
+                and followee in self.crawled_instances
+            ):
+                self.written_links.add(link)
+                links.append((follower, followee, 1))
+        await self._write_links(links)
 
 
-async def launch_peertube_crawl():
-    start_urls = await fetch_fediverse_instance_list("peertube")
-    async with PeertubeCrawler(start_urls) as crawler:
-        await crawler.launch()
+async def launch_peertube_crawl(session=None):
+    async with crawl_session(session) as session:
+        start_urls = await fetch_fediverse_instance_list("peertube", session)
+        async with PeertubeCrawler(start_urls, session) as crawler:
+            await crawler.launch()
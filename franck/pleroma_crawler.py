@@ -1,10 +1,8 @@
 """Pleroma/Akkoma Graph Crawler"""
 
-from .common import fetch_fediverse_instance_list
+from .common import crawl_session, fetch_fediverse_instance_list
 from .mastodon_crawler import MastodonActiveUserCrawler, MastodonFederationCrawler
 
-DELAY_BETWEEN_CONSECUTIVE_REQUESTS = 0.2
-
 
 class PleromaFederationCrawler(MastodonFederationCrawler):
     SOFTWARE = "pleroma"
@@ -18,13 +16,14 @@ class PleromaActiveUserCrawler(MastodonActiveUserCrawler):
     MAX_ID_REGEX = r"max_id=([a-zA-Z0-9]+)"
 
 
-async def launch_pleroma_crawl():
-    start_urls = await fetch_fediverse_instance_list("pleroma")
-    start_urls += await fetch_fediverse_instance_list("akkoma")
-    # start_urls = ["poa.st", "spinster.xyz", "fe.disroot.org"]  # FOR DEBUG
+async def launch_pleroma_crawl(session=None):
+    async with crawl_session(session) as session:
+        start_urls = await fetch_fediverse_instance_list("pleroma", session)
+        start_urls += await fetch_fediverse_instance_list("akkoma", session)
+        # start_urls = ["poa.st", "spinster.xyz", "fe.disroot.org"]  # FOR DEBUG
 
-    async with PleromaFederationCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with PleromaFederationCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
 
-    async with PleromaActiveUserCrawler(start_urls) as crawler:
-        await crawler.launch()
+        async with PleromaActiveUserCrawler(start_urls, session=session) as crawler:
+            await crawler.launch()
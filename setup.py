@@ -18,9 +18,12 @@ setup(
         "scipy",
         "pandas",
         "fastparquet",
-        "requests",
         "colorlog",
+        "orjson",
     ],
+    extras_require={
+        "speedups": ['uvloop>=0.18; sys_platform != "win32"'],
+    },
     entry_points={
         "console_scripts": [
             "franck = franck.cli:main",
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from franck.common import CrawlerException, FederationCrawler
+
+
+class DummyCrawler(FederationCrawler):
+    SOFTWARE = "test"
+
+    async def inspect_instance(self, host):
+        pass
+
+
+class FailingCrawler(DummyCrawler):
+    def __init__(self, urls):
+        super().__init__(urls)
+        self.cancelled_hosts = []
+
+    async def inspect_instance(self, host):
+        if host == "failing.example":
+            raise RuntimeError("Unexpected error")
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled_hosts.append(host)
+            raise
+
+
+class CrawlerLaunchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.prev_dir = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    async def asyncTearDown(self):
+        os.chdir(self.prev_dir)
+        self.tmp_dir.cleanup()
+
+    async def test_failing_worker_stops_the_others(self):
+        hosts = ["failing.example", "a.example", "b.example"]
+        crawler = FailingCrawler(hosts)
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(crawler.launch(), timeout=10)
+
+        self.assertCountEqual(crawler.cancelled_hosts, ["a.example", "b.example"])
+        await crawler.close()
+
+
+class QueryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.prev_dir = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+        self.nb_queries = 0
+
+        async def throttling_handler(_request):
+            self.nb_queries += 1
+            if self.nb_queries == 1:
+                return web.Response(status=429, headers={"Retry-After": "1"})
+            return web.json_response({"ok": True})
+
+        async def truncated_handler(request):
+            self.nb_queries += 1
+            if self.nb_queries == 1:
+                resp = web.StreamResponse()
+                resp.content_length = 100
+                await resp.prepare(request)
+                await resp.write(b'{"ok":')
+                request.transport.close()
+                return resp
+            return web.json_response({"ok": True})
+
+        app = web.Application()
+        app.router.add_get("/api", throttling_handler)
+        app.router.add_get("/truncated", truncated_handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.host = f"127.0.0.1:{port}"
+        self.crawler = DummyCrawler([self.host])
+
+    async def asyncTearDown(self):
+        await self.crawler.close()
+        await self.runner.cleanup()
+        os.chdir(self.prev_dir)
+        self.tmp_dir.cleanup()
+
+    async def test_truncated_response_is_retried(self):
+        resp = await self.crawler._fetch_json("http://" + self.host + "/truncated")
+
+        self.assertEqual(resp, {"ok": True})
+        self.assertEqual(self.nb_queries, 2)
+
+    async def test_throttled_query_follows_retry_after(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        resp = await self.crawler._fetch_json("http://" + self.host + "/api")
+
+        self.assertEqual(resp, {"ok": True})
+        self.assertEqual(self.nb_queries, 2)
+        self.assertGreaterEqual(loop.time() - start, 1)
+        # NB: the successful retry halves the backoff of the instance
+        self.assertEqual(self.crawler.host_backoffs, {self.host: 0.5})
+
+    async def test_ssl_error_does_not_fall_back_to_http(self):
+        # NB: the test server only speaks plain HTTP, so the TLS handshake fails
+        with self.assertRaises(CrawlerException):
+            await self.crawler._fetch_json("https://" + self.host + "/api")
+
+        self.assertEqual(self.nb_queries, 0)
+        self.assertNotIn(self.host, self.crawler.http_only_hosts)
+
+
+class HttpsFallbackTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.prev_dir = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+        self.crawler = DummyCrawler(["h.example"])
+        self.queried_urls = []
+
+        async def request_json(host, url, params, body, op):
+            # NB: the instance refuses the connections on port 443
+            self.queried_urls.append(url)
+            await asyncio.sleep(0.1)
+            if url.startswith("https://"):
+                conn_key = SimpleNamespace(host=host, port=443, ssl=True)
+                err = aiohttp.ClientConnectorError(
+                    conn_key, ConnectionRefusedError(111, "Connection refused")
+                )
+                raise CrawlerException(err) from err
+            return {"url": url}, {}
+
+        self.crawler._request_json = request_json
+
+    async def asyncTearDown(self):
+        await self.crawler.close()
+        os.chdir(self.prev_dir)
+        self.tmp_dir.cleanup()
+
+    async def test_concurrent_first_queries_fall_back_to_http(self):
+        urls = [f"https://h.example/api/{i}" for i in range(3)]
+        results = await asyncio.gather(*map(self.crawler._fetch_json, urls))
+
+        self.assertEqual(
+            results, [{"url": "http://h.example/api/" + str(i)} for i in range(3)]
+        )
+        # NB: only one query probes HTTPS, the others wait for its outcome
+        https_urls = [url for url in self.queried_urls if url.startswith("https://")]
+        self.assertEqual(len(https_urls), 1)
+        self.assertIn("h.example", self.crawler.http_only_hosts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from franck.mastodon_crawler import MastodonActiveUserCrawler
+
+
+class MastodonActiveUserCrawlerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.prev_dir = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        self.crawler = MastodonActiveUserCrawler(["a.example", "b.example"])
+        self.crawler.init_all_files()
+
+    async def asyncTearDown(self):
+        await self.crawler.close()
+        os.chdir(self.prev_dir)
+        self.tmp_dir.cleanup()
+
+    async def test_crawl_user_interactions_writes_follows(self):
+        async def fetch_following(url, params=None):
+            followees = [
+                {"acct": "bob@b.example", "username": "bob"},
+                {"acct": "carol", "username": "carol"},
+                {"acct": "dave@outside.example", "username": "dave"},
+            ]
+            return followees, None
+
+        self.crawler._fetch_json_with_pagination = fetch_following
+        await self.crawler._crawl_user_interactions(
+            "a.example", {"id": "1", "username": "alice", "following_count": 3}
+        )
+        await self.crawler._flush_csv_files()
+
+        with open(
+            self.crawler.result_path(self.crawler.CRAWLED_FOLLOWS_CSV),
+            encoding="utf-8",
+        ) as csv_file:
+            lines = csv_file.read().splitlines()
+        self.assertEqual(lines[0], ",".join(self.crawler.CRAWLED_FOLLOWS_FIELDS))
+        self.assertCountEqual(
+            lines[1:],
+            ["alice,a.example,bob,b.example", "alice,a.example,carol,a.example"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()